@@ -1,9 +1,419 @@
+"""Streamlit front-end for the DJ AI shortlist builder.
 
+Lets a DJ upload a few example tracks, pick genres/years, and build a
+shortlist of similar tracks scraped from the DJDownload catalogue.
+"""
 
+import asyncio
+import functools
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+import aiohttp
+import requests
+import streamlit as st
+from diskcache import Cache
+from requests.adapters import HTTPAdapter, Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 
+from engine import analyze_examples_folder, build_shortlist_from_djdownload
 
+API_BASE = "https://api.djdownload.me"
 
+AVAILABLE_GENRES = [
+    "Afro House",
+    "Deep House",
+    "Tech House",
+    "Melodic House & Techno",
+    "Progressive House",
+    "Organic House",
+    "House",
+    "Techno",
+    "Minimal / Deep Tech",
+]
+AVAILABLE_YEARS = ["2026", "2025", "2024", "Older"]
 
+# Survives process restarts, unlike st.cache_data which is per-process.
+_cache = Cache(".djdl_cache")
 
+# One pooled session for all sync API calls: keep-alive skips the TCP+TLS
+# handshake after the first request, and transient 429/5xx are retried.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]
+        ),
+    ),
+)
 
+
+def _token_fingerprint(token):
+    return hashlib.sha1(token.encode()).hexdigest()[:8]
+
+
+@st.cache_resource
+def _get_token():
+    # Streamlit reruns the whole script on every widget interaction; without
+    # this the token file would be re-read on each rerun.
+    return Path("token.txt").read_text().strip()
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_page1():
+    """Decoded JSON of catalogue page 1.
+
+    Shared between the page-count computation and the first year-boundary
+    probe, so page 1 is only fetched once per cold start.
+    """
+    token = _get_token()
+    key = ("page1", _token_fingerprint(token))
+    hit = _cache.get(key)
+    if hit is not None:
+        return hit
+    r = _SESSION.get(
+        f"{API_BASE}/tracks?page=1",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=15,
+    )
+    r.raise_for_status()
+    data = r.json()
+    _cache.set(key, data, expire=600)
+    return data
+
+
+def get_last_page():
+    """Number of pages the /tracks endpoint currently serves."""
+    data = fetch_page1()
+    total = data.get("total", 0)
+    limit = data.get("limit", 1) or 1
+    # Integer ceil-div: no float round trip, and a server replying limit=0
+    # can't raise ZeroDivisionError.
+    return (total + limit - 1) // max(limit, 1)
+
+
+# last_page creeps up every time new tracks land; quantizing it keeps the
+# boundary cache valid across those small shifts.
+_PAGE_BUCKET = 50
+
+
+def detect_year_boundaries(last_page, wanted=frozenset()):
+    """Map each release year to the first page it appears on.
+
+    *wanted* is the set of years the caller actually needs; probing stops
+    early once all of them have been bracketed.  "Older" needs the full map
+    (it brackets against the oldest boundary), so it disables the shortcut.
+    """
+    wanted = frozenset(wanted)
+    if "Older" in wanted:
+        wanted = frozenset()
+    return _detect_year_boundaries_bucket(last_page // _PAGE_BUCKET, wanted)
+
+
+@st.cache_data(show_spinner="Detecting year boundaries…")
+def _detect_year_boundaries_bucket(bucket, wanted):
+    """Probe a spread of pages and record the first page of each year.
+
+    DJDownload orders /tracks newest-first, so probing a spread of pages is
+    enough to bracket where each year starts.  The probes are independent
+    HTTP calls, so they are fanned out concurrently instead of paying one
+    round trip per page.
+    """
+    # Round the proxy *up* to the bucket edge: probing past the real end is
+    # harmless (empty pages carry no year and are skipped), but probing
+    # short of it can miss the oldest selected year entirely.
+    last_page = (bucket + 1) * _PAGE_BUCKET
+    token = _get_token()
+    # v2: maps cached before the bracketing fix may be truncated at the
+    # oldest wanted year; a new key keeps them from serving a bad range
+    # for the rest of their TTL.
+    key = (
+        "year_boundaries_v2",
+        bucket,
+        tuple(sorted(wanted)),
+        _token_fingerprint(token),
+    )
+    hit = _cache.get(key)
+    if hit is not None:
+        return hit
+    headers = {"Authorization": f"Bearer {token}", "User-Agent": "Mozilla/5.0"}
+    # Page 1 was already fetched for the page count — reuse the payload and
+    # only probe the remaining pages.
+    probe_pages = sorted(
+        {*(max(1, last_page * i // 10) for i in range(1, 10)), last_page} - {1}
+    )
+
+    def _first_year(data):
+        tracks = data.get("tracks", [])
+        return tracks[0].get("release_date", "")[:4] if tracks else ""
+
+    async def _fetch(session, page):
+        # Historical pages never change their first track, so a stored ETag
+        # turns the re-probe into a bodyless 304.
+        etag_key = ("probe_etag", page, _token_fingerprint(token))
+        cached = _cache.get(etag_key)
+        req_headers = {"If-None-Match": cached[0]} if cached else {}
+        async with session.get(
+            f"{API_BASE}/tracks?page={page}",
+            headers=req_headers,
+            timeout=aiohttp.ClientTimeout(total=15),
+        ) as r:
+            if r.status == 304 and cached:
+                return page, cached[1]
+            year = _first_year(await r.json())
+            etag = r.headers.get("ETag")
+            if etag and year:
+                _cache.set(etag_key, (etag, year), expire=30 * 86400)
+            return page, year
+
+    year_map = {}
+
+    def _note(page, year):
+        if year:
+            year_map[year] = min(year_map.get(year, page), page)
+
+    def _covered():
+        # Seeing every wanted year isn't enough: _compute_page_range closes
+        # each range at the first page of the next-older year and falls back
+        # to the catalogue tail when that boundary is missing.  Keep probing
+        # until a year strictly older than the oldest wanted one has been
+        # seen, so every wanted year is actually bracketed.
+        if not wanted or not wanted.issubset(year_map):
+            return False
+        oldest = min(int(y) for y in wanted)
+        return any(y.isdigit() and int(y) < oldest for y in year_map)
+
+    async def _probe():
+        async with aiohttp.ClientSession(headers=headers) as session:
+            tasks = [
+                asyncio.ensure_future(_fetch(session, page)) for page in probe_pages
+            ]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    try:
+                        page, year = await fut
+                    except Exception:
+                        continue
+                    _note(page, year)
+                    if _covered():
+                        break
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    _note(1, _first_year(fetch_page1()))
+    if not _covered():
+        asyncio.run(_probe())
+    # Historical pages never change their first-seen year, so a long TTL is safe.
+    _cache.set(key, year_map, expire=7 * 86400)
+    return year_map
+
+
+def _digest(file):
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: file.read(1 << 20), b""):
+        h.update(chunk)
+    file.seek(0)
+    return h.hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def _materialize_examples(digests, _files):
+    """Write the uploaded examples to a temp dir, keyed by content digest.
+
+    Streamlit re-presents the same uploads on every rerun; hashing their
+    bytes lets repeated Build clicks reuse the directory already on disk
+    instead of re-writing every MP3.  ``_files`` is underscore-prefixed so
+    the unhashable UploadedFile objects stay out of the cache key.
+    """
+    examples_dir = Path(tempfile.mkdtemp(prefix="djai_examples_"))
+
+    def _save(file):
+        # Stream in 1 MiB chunks so peak memory stays flat regardless of
+        # how large the uploaded files are.
+        with open(examples_dir / file.name, "wb") as out:
+            shutil.copyfileobj(file, out, length=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=min(8, len(_files))) as ex:
+        list(ex.map(_save, _files))
+    return examples_dir
+
+
+@functools.lru_cache(maxsize=64)
+def _compute_page_range(years_tuple, boundaries_tuple, last_page):
+    """Pure min/max reduction of the selected years onto page boundaries.
+
+    Takes only hashable arguments so identical selections across reruns hit
+    the lru_cache, and so the logic is testable without Streamlit.
+    """
+    boundaries = dict(boundaries_tuple)
+    starts, ends = [], []
+    for year in years_tuple:
+        if year == "Older":
+            starts.append(max(boundaries.values(), default=1))
+            ends.append(last_page)
+        elif year in boundaries:
+            first = boundaries[year]
+            starts.append(first)
+            later = [p for p in boundaries.values() if p > first]
+            ends.append(min(later, default=last_page))
+    if not starts:
+        return 1, last_page
+    return min(starts), max(ends)
+
+
+def _resolve_page_range(selected_years):
+    """Pages to scan for the selected years (network-backed, cached)."""
+    last_page = get_last_page()
+    year_boundaries = detect_year_boundaries(last_page, frozenset(selected_years))
+    return _compute_page_range(
+        tuple(selected_years), tuple(sorted(year_boundaries.items())), last_page
+    )
+
+
+st.set_page_config(page_title="DJ AI Shortlist", page_icon="🎧", layout="wide")
+st.title("🎧 DJ AI Shortlist")
+
+
+# The page count takes a network call to fetch.  Reserve the slot now and
+# fill it in after the form has been emitted: elements stream to the
+# browser in script order, so the widgets paint before this call runs.
+_header_slot = st.empty()
+
+# One form = one rerun when the user hits Build, instead of a full script
+# rerun per checkbox toggle or slider drag while they configure the scan.
+with st.form("config"):
+    # Single widgets instead of per-option checkboxes: one piece of state
+    # each, far fewer DOM nodes to diff per rerun.
+    selected_genres = st.multiselect("🎼 Genres", AVAILABLE_GENRES, default=["Afro House"])
+    selected_years = st.multiselect("📅 Years", AVAILABLE_YEARS, default=["2026", "2025"])
+
+    threshold = st.slider("🎯 Similarity threshold", 0.0, 1.0, 0.70, 0.05)
+
+    uploaded_files = st.file_uploader(
+        "🎵 Example tracks (the vibe to match)",
+        type=["mp3", "wav"],
+        accept_multiple_files=True,
+    )
+
+    submitted = st.form_submit_button("🚀 Build shortlist", use_container_width=True)
+
+_header_slot.caption(f"DJDownload currently serves {get_last_page()} pages of tracks.")
+
+
+@st.fragment
+def _page_range_fragment():
+    # Auto page range: restrict the scan to the pages covering the selected
+    # years.  Isolated in a fragment so it never delays the main render.
+    start_page, end_page = _resolve_page_range(tuple(selected_years))
+    st.caption(f"Will scan pages {start_page}–{end_page}.")
+
+
+_page_range_fragment()
+
+if submitted:
+    if not uploaded_files:
+        st.error("Upload at least one example track first.")
+        st.stop()
+
+    digests = tuple(sorted(_digest(file) for file in uploaded_files))
+    examples_dir = _materialize_examples(digests, uploaded_files)
+
+    with st.spinner("Profiling example tracks…"):
+        example_profile = analyze_examples_folder(examples_dir)
+
+    start_page, end_page = _resolve_page_range(tuple(selected_years))
+    output_dir = Path(tempfile.mkdtemp(prefix="djai_shortlist_"))
+
+    # Run the scan off the script thread: the script keeps rerunning (and
+    # the Stop button keeps being read) while the engine works, instead of
+    # blocking inside st.spinner until the whole scan returns.
+    job = {
+        "done": False,
+        "result": None,
+        "page": 0,
+        "pages": 1,
+        "kept": 0,
+        "stop": {"stop": False},
+        "output_dir": output_dir,
+    }
+
+    def _progress(current_page, total_pages, kept_count):
+        job["page"], job["pages"], job["kept"] = current_page, total_pages, kept_count
+
+    def _runner():
+        try:
+            job["result"] = build_shortlist_from_djdownload(
+                example_profile=example_profile,
+                genres=selected_genres,
+                years=selected_years,
+                start_page=start_page,
+                end_page=end_page,
+                threshold=threshold,
+                output_folder=output_dir,
+                stop_flag=job["stop"],
+                progress_callback=_progress,
+            )
+        finally:
+            job["done"] = True
+
+    thread = threading.Thread(target=_runner, daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+    st.session_state["job"] = job
+
+job = st.session_state.get("job")
+if job is not None:
+    if not job["done"]:
+        if st.button("🛑 Stop"):
+            job["stop"]["stop"] = True
+        st.progress(job["page"] / job["pages"])
+        st.info(f"Scanning page {job['page']}/{job['pages']}…")
+        st.success(f"Kept {job['kept']} tracks so far")
+        time.sleep(0.25)
+        st.rerun()
+
+    result = job["result"]
+    output_dir = job["output_dir"]
+    if result is None:
+        st.error("Scan failed — check the logs.")
+        st.stop()
+    st.success(f"Done — kept {result['kept']} of {result['scanned']} tracks scanned.")
+
+    # Build the archive straight into memory: one pass over the bytes and no
+    # shortlist.zip left behind in temp.  The engine already knows every
+    # file it wrote, so there is no directory walk at all.
+    files = [(path, os.path.basename(path)) for path in result["files"]]
+    buf = io.BytesIO()
+    base = str(output_dir) + os.sep
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zipf:
+        for path, name in files:
+            # Slice off the precomputed prefix rather than paying
+            # Path.relative_to per entry.
+            # MP3/AAC payloads are already compressed — deflating them
+            # burns CPU for ~0% size win, so store them verbatim.
+            compress_type = (
+                zipfile.ZIP_STORED
+                if os.path.splitext(name)[1].lower() in {".mp3", ".m4a", ".ogg", ".aac"}
+                else zipfile.ZIP_DEFLATED
+            )
+            zipf.write(path, arcname=path[len(base):], compress_type=compress_type)
+    st.caption(f"{len(files)} files in the archive.")
+    st.download_button(
+        "📥 Download shortlist (ZIP)",
+        data=buf.getvalue(),
+        file_name="dj_ai_shortlist.zip",
+        mime="application/zip",
+    )
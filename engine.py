@@ -1,3 +1,700 @@
+"""Core engine: fetch DJDownload tracks, analyze audio, score similarity.
 
+Kept free of Streamlit imports so it can be driven from the app or from a
+plain script.
+"""
 
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 
+import aiohttp
+import numpy as np
+import orjson
+from diskcache import Cache
+from numba import njit
+
+# Optional CUDA fast path: torch is not a declared dependency, but when it is
+# installed next to a GPU the DSP stage runs as batched tensor ops instead of
+# per-track librosa calls.
+try:
+    import torch
+except ImportError:
+    torch = None
+
+API_BASE = "https://api.djdownload.me"
+CACHE_ROOT = Path(tempfile.gettempdir()) / "djai_cache"
+CACHE_ROOT.mkdir(parents=True, exist_ok=True)
+
+# One analysis worker per core; downloads are capped at 2x that so streamed
+# previews don't pile up on disk faster than the workers drain them.
+ANALYSIS_WORKERS = os.cpu_count() or 2
+MAX_CONCURRENT_DOWNLOADS = 2 * ANALYSIS_WORKERS
+
+# Feature profiles per track, persisted across runs: re-running with a
+# different threshold or genre mix skips all repeat downloads and DSP.
+_FEATURES = Cache(str(CACHE_ROOT / "features"))
+
+
+def _track_key(track):
+    track_id = track.get("id")
+    if track_id is not None:
+        return f"id:{track_id}"
+    return "sha1:" + hashlib.sha1(track["url"].encode()).hexdigest()
+
+
+SUPPORTED_EXT = {".mp3", ".wav", ".flac", ".m4a", ".ogg"}
+KEYS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Relative importance of each feature when scoring a candidate against the
+# example profile.  Must sum to 1.
+WEIGHTS = {"bpm": 0.35, "rhythm": 0.25, "brightness": 0.20, "bass": 0.15, "key": 0.05}
+
+
+_TOKEN = None
+
+
+def load_token():
+    # Read once per process: api_headers() is called for every session, and
+    # re-reading token.txt each time is a stat+open+read per call.
+    global _TOKEN
+    if _TOKEN is None:
+        _TOKEN = (Path(__file__).parent / "token.txt").read_text().strip()
+    return _TOKEN
+
+
+def api_headers():
+    return {"Authorization": f"Bearer {load_token()}", "User-Agent": "Mozilla/5.0"}
+
+
+def _connector():
+    """Pooled keep-alive connector shared by every call in a scan.
+
+    One warm connection pool per session means the TCP+TLS handshake is
+    paid once, not once per page or preview.
+    """
+    return aiohttp.TCPConnector(limit=32, limit_per_host=32, keepalive_timeout=30)
+
+
+async def fetch_tracks(session, page, retries=3):
+    """Return the track list for one catalogue page."""
+    for attempt in range(retries):
+        try:
+            async with session.get(
+                f"{API_BASE}/tracks?page={page}", timeout=aiohttp.ClientTimeout(total=20)
+            ) as r:
+                if r.status in (429, 502, 503, 504) and attempt < retries - 1:
+                    raise aiohttp.ClientResponseError(
+                        r.request_info, r.history, status=r.status
+                    )
+                r.raise_for_status()
+                # orjson parses the page payload severalfold faster than the
+                # stdlib json that aiohttp's .json() defaults to.
+                return orjson.loads(await r.read()).get("tracks", [])
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(0.3 * 2**attempt)
+
+
+# Analysis decodes at most 60 s at 22.05 kHz, which lives in roughly the
+# first 2 MiB of a preview MP3 — no point downloading the rest to score it.
+ANALYSIS_BYTES = 2 << 20
+
+
+async def stream_track(session, url, max_bytes=None):
+    """Download a track preview into memory; returns a BytesIO.
+
+    Most candidates are rejected after analysis, so writing them to a temp
+    file first just pushed every discarded preview through the page cache
+    twice.  Bytes only touch disk when a track is actually kept.
+
+    *max_bytes* requests only that prefix via an HTTP Range header and
+    hard-caps the buffer as a defence against servers that ignore Range.
+    """
+    headers = {"Range": f"bytes=0-{max_bytes - 1}"} if max_bytes else {}
+    buf = io.BytesIO()
+    async with session.get(
+        url, headers=headers, timeout=aiohttp.ClientTimeout(total=60)
+    ) as r:
+        r.raise_for_status()
+        # 256 KiB chunks: ~4x fewer loop iterations per preview than the
+        # previous 64 KiB.
+        async for chunk in r.content.iter_chunked(262144):
+            buf.write(chunk)
+            if max_bytes and buf.tell() >= max_bytes:
+                break
+    buf.seek(0)
+    return buf
+
+
+def analyze_track(audio_path):
+    """Extract the 5-feature profile (bpm, rhythm, brightness, bass, key).
+
+    *audio_path* may be a filesystem path or a file-like object; librosa
+    accepts both.
+    """
+    # Imported here so forked pool workers load librosa lazily instead of
+    # inheriting (and re-initializing) its state at module import.
+    import librosa
+
+    try:
+        # 22.05 kHz mono and 60 s are plenty for BPM/chroma/brightness
+        # aggregates; half the sample rate halves the STFT FLOPs, and
+        # kaiser_fast keeps the resample cheap on the audioread MP3 path.
+        y, sr = librosa.load(
+            audio_path,
+            sr=22050,
+            mono=True,
+            duration=60,
+            res_type="kaiser_fast",
+            dtype=np.float32,
+        )
+    except Exception:
+        return None
+    if y.size == 0:
+        return None
+    # beat_track recomputes an onset envelope when given raw audio; compute
+    # it once and share it between the tempo and rhythm features.
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    tempo, _ = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
+    rhythm = float(onset_env.mean())
+    # One STFT feeds chroma, centroid, and the bass band; chroma_stft and
+    # spectral_centroid would each recompute it from y otherwise.
+    # complex64 keeps the whole spectrogram in float32: the FFT at this size
+    # is memory-bound, so halving the element width roughly halves its cost.
+    S = np.abs(librosa.stft(y, dtype=np.complex64))
+    freqs = librosa.fft_frequencies(sr=sr)
+    # The key only ever feeds an equality check, so chroma_stft's tuning
+    # machinery is overkill: fold the mean FFT-bin magnitudes onto 12 pitch
+    # classes and take the argmax.
+    mags = S.mean(axis=1, dtype=np.float32)
+    pitched = freqs > 0
+    pitch_class = np.round(librosa.hz_to_midi(freqs[pitched])).astype(int) % 12
+    chroma12 = np.bincount(pitch_class, weights=mags[pitched], minlength=12)
+    key = KEYS[int(chroma12.argmax())]
+    brightness = float(librosa.feature.spectral_centroid(S=S, sr=sr).mean())
+    bass = float(S[(freqs >= 20) & (freqs <= 150)].mean())
+    return {
+        "bpm": float(np.atleast_1d(tempo)[0]),
+        "rhythm": rhythm,
+        "brightness": brightness,
+        "bass": bass,
+        "key": key,
+    }
+
+
+# Structure-of-arrays layout for vectorized scoring: the four numeric
+# features in a fixed column order, key handled separately as an equality
+# bonus.
+_FEATURE_ORDER = ("bpm", "rhythm", "brightness", "bass")
+_WEIGHT_VEC = np.array([WEIGHTS[k] for k in _FEATURE_ORDER], dtype=np.float32)
+
+
+# numba is already a hard dependency via librosa, so JIT-compiling the hot
+# kernel costs no install budget; cache=True persists the compilation across
+# processes and Streamlit reruns.
+@njit(cache=True, fastmath=True)
+def _score_kernel(cand, ex, divisors, weights, key_match, key_weight):
+    out = np.empty(cand.shape[0], dtype=np.float32)
+    for i in range(cand.shape[0]):
+        s = key_weight * key_match[i]
+        for j in range(cand.shape[1]):
+            d = 1.0 - abs(cand[i, j] - ex[j]) / divisors[j]
+            if d > 0.0:
+                s += weights[j] * d
+        out[i] = s
+    return out
+
+
+def score_batch(example, candidates):
+    """Score many candidate profiles against *example* in one compiled pass."""
+    cand = np.array(
+        [[c[k] for k in _FEATURE_ORDER] for c in candidates], dtype=np.float32
+    )
+    ex = np.array([example[k] for k in _FEATURE_ORDER], dtype=np.float32)
+    divisors = np.array(
+        [
+            30.0,
+            max(example["rhythm"], 1e-6),
+            max(example["brightness"], 1e-6),
+            max(example["bass"], 1e-6),
+        ],
+        dtype=np.float32,
+    )
+    example_key = example["key"]
+    key_match = np.array(
+        [c["key"] == example_key for c in candidates], dtype=np.float32
+    )
+    return _score_kernel(
+        cand, ex, divisors, _WEIGHT_VEC, key_match, np.float32(WEIGHTS["key"])
+    )
+
+
+def similarity_score(example, candidate):
+    """Weighted similarity in [0, 1] between two feature profiles."""
+    return float(score_batch(example, [candidate])[0])
+
+
+def analyze_examples_folder(folder):
+    """Average the feature profiles of every supported file in *folder*."""
+    paths = [
+        path
+        for path in sorted(Path(folder).iterdir())
+        if path.suffix.lower() in SUPPORTED_EXT
+    ]
+    # The heavy lifting is NumPy/FFT C code that releases the GIL, so plain
+    # threads give near-linear speedup here.
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as ex:
+        features = [f for f in ex.map(analyze_track, paths) if f]
+    if not features:
+        raise ValueError("No analyzable example tracks found in folder")
+    means = np.array(
+        [[f[k] for k in _FEATURE_ORDER] for f in features], dtype=np.float32
+    ).mean(axis=0)
+    profile = dict(zip(_FEATURE_ORDER, (float(m) for m in means)))
+    profile["key"] = Counter(f["key"] for f in features).most_common(1)[0][0]
+    return profile
+
+
+def _year_matches(release_date, years):
+    year = release_date[:4]
+    if "Older" in years and year and year < "2024":
+        return True
+    return year in years
+
+
+def build_shortlist_from_djdownload(
+    example_profile,
+    genres,
+    years,
+    start_page,
+    end_page,
+    threshold,
+    output_folder,
+    stop_flag=None,
+    progress_callback=None,
+):
+    """Scan the catalogue page range and keep tracks scoring >= *threshold*.
+
+    Kept tracks are moved into ``output_folder/<genre>/``.  Returns a summary
+    dict with scanned/kept counts.
+
+    The scan is network-bound, so the whole pipeline runs on asyncio: one
+    shared aiohttp session, a semaphore-bounded download fan-out per page,
+    and the next page's track list prefetched while the current page is
+    being processed.
+    """
+    return asyncio.run(
+        _build_async(
+            example_profile,
+            genres,
+            years,
+            start_page,
+            end_page,
+            threshold,
+            Path(output_folder),
+            stop_flag,
+            progress_callback,
+        )
+    )
+
+
+def _stopped(stop_flag):
+    return bool(stop_flag and stop_flag.get("stop"))
+
+
+def _wanted(track, genres, years):
+    # One .get per field: each repeated lookup re-hashes the key.
+    url, genre, release_date = (
+        track.get("url"),
+        track.get("genre"),
+        track.get("release_date", ""),
+    )
+    if url is None:
+        return False
+    if genres and genre not in genres:
+        return False
+    if years and not _year_matches(release_date, years):
+        return False
+    return True
+
+
+def _metadata_prescore(track, example_profile):
+    """Cheap score estimate from API metadata alone, or None if unavailable.
+
+    Dimensions the metadata can't see are assumed perfect, and the bpm
+    term folds out tempo octaves — beat_track routinely halves or doubles
+    house tempos, so the example's estimate may sit an octave away from a
+    correctly tagged candidate.  The result is still a heuristic, not a
+    sound bound: the metadata bpm stands in for the estimate the full
+    analysis would produce, so a track can in principle be skipped that
+    the DSP would have kept.  With octaves folded out that requires the
+    tagged tempo to be genuinely far from the example's.
+    """
+    bpm = track.get("bpm") or track.get("tempo")
+    if bpm is None:
+        return None
+    try:
+        bpm = float(bpm)
+    except (TypeError, ValueError):
+        return None
+    gap = min(abs(example_profile["bpm"] - b) for b in (bpm, bpm / 2.0, bpm * 2.0))
+    score = WEIGHTS["bpm"] * max(0.0, 1.0 - gap / 30.0)
+    score += WEIGHTS["rhythm"] + WEIGHTS["brightness"] + WEIGHTS["bass"]
+    key = track.get("key")
+    if key is None or key == example_profile["key"]:
+        score += WEIGHTS["key"]
+    return score
+
+
+# Waveforms per CUDA batch; amortizes kernel launches without letting the
+# padded (B, T) tensor outgrow device memory.
+GPU_BATCH = 32
+
+
+def _gpu_available():
+    return torch is not None and torch.cuda.is_available()
+
+
+def _decode_waves(bufs):
+    """CPU side of the GPU path: decode buffers to 22.05 kHz mono float32."""
+    import librosa
+
+    waves = []
+    for buf in bufs:
+        try:
+            y, _ = librosa.load(
+                buf,
+                sr=22050,
+                mono=True,
+                duration=60,
+                res_type="kaiser_fast",
+                dtype=np.float32,
+            )
+        except Exception:
+            y = None
+        waves.append(y if y is not None and y.size else None)
+    return waves
+
+
+def _analyze_batch_gpu(waves, sr=22050, n_fft=2048, hop=512):
+    """Feature profiles for many decoded waveforms in one CUDA batch.
+
+    Mirrors analyze_track: everything derives from a single padded-batch
+    STFT, with the onset envelope rebuilt the way onset_strength builds
+    it (mel projection, dB compression, half-wave-rectified flux) and
+    tempo taken from its autocorrelation peak in the 60-180 BPM range.
+    """
+    import librosa
+
+    device = "cuda"
+    batch = torch.zeros(len(waves), max(len(w) for w in waves))
+    for i, wave in enumerate(waves):
+        batch[i, : len(wave)] = torch.from_numpy(wave)
+    batch = batch.to(device, non_blocking=True)
+    window = torch.hann_window(n_fft, device=device)
+    S = torch.stft(
+        batch, n_fft, hop_length=hop, window=window, return_complex=True
+    ).abs()
+    freqs = torch.linspace(0.0, sr / 2.0, S.shape[1], device=device)
+    mags = S.mean(dim=2)
+    brightness = (
+        (S * freqs[None, :, None]).sum(dim=1) / S.sum(dim=1).clamp_min(1e-9)
+    ).mean(dim=1)
+    bass = S[:, (freqs >= 20) & (freqs <= 150), :].mean(dim=(1, 2))
+    midi = 12.0 * torch.log2(freqs.clamp_min(1.0) / 440.0) + 69.0
+    pitch_class = torch.round(midi).long() % 12
+    pitched = freqs > 0
+    chroma12 = torch.zeros(len(waves), 12, device=device)
+    chroma12.index_add_(1, pitch_class[pitched], mags[:, pitched])
+    keys = chroma12.argmax(dim=1)
+    # The rhythm feature must land on the same scale as analyze_track's
+    # onset_strength — these profiles share the feature cache with the CPU
+    # path.  Raw linear-magnitude flux runs ~20x hotter, so project onto
+    # the mel basis and compress to dB (with power_to_db's 80 dB floor)
+    # before taking the half-wave-rectified flux.
+    mel_fb = torch.from_numpy(
+        librosa.filters.mel(sr=sr, n_fft=n_fft).astype(np.float32)
+    ).to(device)
+    mel = torch.einsum("mf,bft->bmt", mel_fb, S * S)
+    db = 10.0 * torch.log10(mel.clamp_min(1e-10))
+    db = torch.maximum(db, db.amax(dim=(1, 2), keepdim=True) - 80.0)
+    flux = torch.relu(db[:, :, 1:] - db[:, :, :-1]).mean(dim=1)
+    rhythm = flux.mean(dim=1)
+    fps = sr / hop
+    lags = range(int(fps * 60 / 180), int(fps * 60 / 60) + 1)
+    centered = flux - flux.mean(dim=1, keepdim=True)
+    autocorr = torch.stack(
+        [(centered[:, :-lag] * centered[:, lag:]).mean(dim=1) for lag in lags], dim=1
+    )
+    bpm = 60.0 * fps / (autocorr.argmax(dim=1) + lags.start).float()
+    return [
+        {
+            "bpm": float(bpm[i]),
+            "rhythm": float(rhythm[i]),
+            "brightness": float(brightness[i]),
+            "bass": float(bass[i]),
+            "key": KEYS[int(keys[i])],
+        }
+        for i in range(len(waves))
+    ]
+
+
+def _analyze_and_score(audio_bytes, example_profile):
+    """Pool worker: feature extraction plus scoring for one downloaded track.
+
+    Takes raw bytes (BytesIO doesn't pickle across the process boundary).
+    """
+    features = analyze_track(io.BytesIO(audio_bytes))
+    if features is None:
+        return None, 0.0
+    return features, similarity_score(example_profile, features)
+
+
+async def _process_track(
+    session, sem, pool, track, cached_score, example_profile, threshold, output_folder, genre_dirs
+):
+    """Download, analyze, and score one track.
+
+    Returns the path the track was written to if it was kept, else None.
+    *cached_score* is the batch-computed score when the track's features
+    were already cached.
+    """
+    if cached_score is not None and cached_score < threshold:
+        # Known miss from a previous run: no download, no DSP.
+        return None
+    if cached_score is None:
+        pre = _metadata_prescore(track, example_profile)
+        if pre is not None and pre < threshold:
+            # Even a perfect analysis can't lift this one past the
+            # threshold; skip the expensive part.
+            return None
+    # Cached-score keepers need the whole file; tracks still waiting on
+    # analysis only need the prefix the DSP actually decodes.
+    limit = None if cached_score is not None else ANALYSIS_BYTES
+    async with sem:
+        try:
+            buf = await stream_track(session, track["url"], max_bytes=limit)
+        except Exception:
+            return None
+    if cached_score is not None:
+        score = cached_score
+    else:
+        # The DSP is CPU-bound; running it in the process pool keeps the
+        # event loop free to stream the next tracks while this one is
+        # analyzed.
+        loop = asyncio.get_running_loop()
+        features, score = await loop.run_in_executor(
+            pool, _analyze_and_score, buf.getvalue(), example_profile
+        )
+        if features is None:
+            return None
+        _FEATURES.set(_track_key(track), features)
+    if score < threshold:
+        return None
+    if limit is not None:
+        # The analysis prefix isn't the full file; re-fetch it whole now
+        # that the track has earned a spot in the shortlist.
+        async with sem:
+            try:
+                buf = await stream_track(session, track["url"])
+            except Exception:
+                return None
+    return _persist_track(track, buf, output_folder, genre_dirs)
+
+
+async def _process_page_gpu(
+    session, sem, candidates, cached_scores, example_profile, threshold, output_folder, genre_dirs
+):
+    """GPU variant of the per-page stage: batch the DSP onto CUDA.
+
+    Downloads the surviving candidates as usual, decodes them on CPU
+    threads, then analyzes up to GPU_BATCH waveforms per torch call so
+    kernel-launch overhead is paid once per batch rather than per track.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def _grab(track, max_bytes=None):
+        async with sem:
+            try:
+                return await stream_track(session, track["url"], max_bytes=max_bytes)
+            except Exception:
+                return None
+
+    todo = []
+    for i, (track, score) in enumerate(zip(candidates, cached_scores)):
+        if score is not None and score < threshold:
+            continue
+        if score is None:
+            pre = _metadata_prescore(track, example_profile)
+            if pre is not None and pre < threshold:
+                continue
+        todo.append(i)
+
+    # Tracks awaiting analysis only need the prefix the DSP decodes;
+    # cached-score keepers need the whole file for the shortlist.
+    bufs = dict(
+        zip(
+            todo,
+            await asyncio.gather(
+                *(
+                    _grab(
+                        candidates[i],
+                        ANALYSIS_BYTES if cached_scores[i] is None else None,
+                    )
+                    for i in todo
+                )
+            ),
+        )
+    )
+    scores = {i: cached_scores[i] for i in todo if cached_scores[i] is not None}
+    pending = [i for i in todo if bufs[i] is not None and cached_scores[i] is None]
+
+    for batch_start in range(0, len(pending), GPU_BATCH):
+        chunk = pending[batch_start : batch_start + GPU_BATCH]
+        waves = await loop.run_in_executor(
+            None, _decode_waves, [bufs[i] for i in chunk]
+        )
+        decoded = [(i, wave) for i, wave in zip(chunk, waves) if wave is not None]
+        if not decoded:
+            continue
+        features = _analyze_batch_gpu([wave for _, wave in decoded])
+        batch_scores = score_batch(example_profile, features)
+        for (i, _), feats, score in zip(decoded, features, batch_scores):
+            _FEATURES.set(_track_key(candidates[i]), feats)
+            scores[i] = float(score)
+
+    kept = []
+    for i, score in sorted(scores.items()):
+        if bufs.get(i) is None or score < threshold:
+            continue
+        buf = bufs[i]
+        if cached_scores[i] is None:
+            # Analyzed from a Range-limited prefix; fetch the full file
+            # before persisting.
+            buf = await _grab(candidates[i])
+            if buf is None:
+                continue
+        kept.append(_persist_track(candidates[i], buf, output_folder, genre_dirs))
+    return kept
+
+
+def _persist_track(track, buf, output_folder, genre_dirs):
+    """Write a kept track's bytes into its genre directory; returns the path."""
+    genre = track.get("genre") or "Unknown"
+    genre_dir = genre_dirs.get(genre)
+    if genre_dir is None:
+        # Unfiltered scans can surface genres that weren't pre-created.
+        genre_dir = output_folder / genre.replace(" ", "_")
+        genre_dir.mkdir(parents=True, exist_ok=True)
+        genre_dirs[genre] = genre_dir
+    filename = f"{track.get('title', 'track').replace('/', '_')}.mp3"
+    dest = genre_dir / filename
+    # Write to a sibling temp file and os.replace it into place: the rename
+    # is a single syscall with no cross-device fallback logic (same
+    # filesystem by construction), and readers never see a partial MP3.
+    fd, tmp_name = tempfile.mkstemp(dir=str(genre_dir), suffix=".part")
+    with os.fdopen(fd, "wb") as out:
+        out.write(buf.getbuffer())
+    os.replace(tmp_name, dest)
+    return str(dest)
+
+
+async def _build_async(
+    example_profile,
+    genres,
+    years,
+    start_page,
+    end_page,
+    threshold,
+    output_folder,
+    stop_flag,
+    progress_callback,
+):
+    scanned = 0
+    kept_files = []
+    total_pages = end_page - start_page + 1
+    sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    # One mkdir per genre up front instead of a stat+mkdir per kept track.
+    genre_dirs = {}
+    for genre in genres or []:
+        genre_dir = output_folder / genre.replace(" ", "_")
+        genre_dir.mkdir(parents=True, exist_ok=True)
+        genre_dirs[genre] = genre_dir
+    pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+
+    async with aiohttp.ClientSession(
+        headers=api_headers(), connector=_connector()
+    ) as session:
+        next_page = asyncio.ensure_future(fetch_tracks(session, start_page))
+        for page in range(start_page, end_page + 1):
+            if _stopped(stop_flag):
+                next_page.cancel()
+                break
+            try:
+                tracks = await next_page
+            except Exception:
+                tracks = []
+            if page < end_page:
+                # Prefetch the following page while this one is processed.
+                next_page = asyncio.ensure_future(fetch_tracks(session, page + 1))
+
+            candidates = [t for t in tracks if _wanted(t, genres, years)]
+            scanned += len(candidates)
+            if candidates and not _stopped(stop_flag):
+                # Score every cache-hit candidate on the page in one
+                # vectorized pass instead of per-track Python arithmetic.
+                cached = [_FEATURES.get(_track_key(t)) for t in candidates]
+                known = [i for i, f in enumerate(cached) if f is not None]
+                cached_scores = [None] * len(candidates)
+                if known:
+                    batch = score_batch(example_profile, [cached[i] for i in known])
+                    for i, score in zip(known, batch):
+                        cached_scores[i] = float(score)
+                if _gpu_available():
+                    kept_files.extend(
+                        await _process_page_gpu(
+                            session,
+                            sem,
+                            candidates,
+                            cached_scores,
+                            example_profile,
+                            threshold,
+                            output_folder,
+                            genre_dirs,
+                        )
+                    )
+                else:
+                    results = await asyncio.gather(
+                        *(
+                            _process_track(
+                                session,
+                                sem,
+                                pool,
+                                track,
+                                cached_scores[i],
+                                example_profile,
+                                threshold,
+                                output_folder,
+                                genre_dirs,
+                            )
+                            for i, track in enumerate(candidates)
+                        )
+                    )
+                    kept_files.extend(path for path in results if path)
+            if progress_callback:
+                progress_callback(page - start_page + 1, total_pages, len(kept_files))
+
+    pool.shutdown()
+    return {
+        "scanned": scanned,
+        "kept": len(kept_files),
+        "files": kept_files,
+        "output": str(output_folder),
+    }